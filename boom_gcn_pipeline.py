@@ -1,18 +1,24 @@
 import os
 import time
+import heapq
+import itertools
+import operator
 import argparse
 import traceback
 
+import numpy as np
 from dotenv import load_dotenv
+from datetime import datetime, UTC
 
 from gcn.produce_gcn_notices import produce_gcn_heartbeat, produce_to_gcn
-from utils.api import SkyPortal, APIError
+from utils.api import SkyPortal, APIError, LOCALIZATION_TAG
 from utils.logger import log, RED, ENDC, YELLOW
-from utils.skymap import get_skymap
+from utils.skymap import AlertBatch, SkymapIndex, get_skymaps, crossmatch, union_moc, contains_alerts
+from utils.moc_cache import evict_moc_cache
 from utils.kafka import read_avro, boom_consumer
-from utils.converter import fallback, str_to_bool
+from utils.converter import str_to_bool, timestamp_to_jd, iso_to_timestamp
 from utils.gcn import prepare_gcn_payload
-from utils.slack import send_to_slack
+from utils.slack import send_to_slack_in_background
 
 load_dotenv()
 
@@ -24,10 +30,17 @@ NOTIFY_SLACK = str_to_bool(os.getenv("NOTIFY_SLACK"), default=False)
 GCN = 24*6  # hours for GCN fallback
 FIRST_DETECTION = 24*5  # hours for first detection fallback
 SLEEP_TIME = 20 # seconds between each loop
+MIN_SLEEP_TIME = 5 # seconds, lower bound of the GCN polling interval while new localizations are coming in
+MAX_SLEEP_TIME = 60 # seconds, upper bound of the GCN polling interval when idle
 HEARTBEAT_INTERVAL = 120 # seconds between each heartbeat log
+ALERT_BATCH_SIZE = 100 # maximum number of alerts consumed and crossmatched at once
+MAX_CONSUME_TIMEOUT = 30.0 # seconds, longest wait for new alerts from Boom Kafka
 
 
-def get_filtered_photometry(alert, snr_threshold, first_detection_fallback):
+PHOTOMETRY_COLUMNS = operator.itemgetter("programid", "origin", "flux", "flux_err", "jd")
+
+
+def get_filtered_photometry(alert, snr_threshold, first_detection_fallback_jd):
     """
     Filter the photometry of an alert to keep only the last non-detection and all detections,
     while also checking if the object is too old based on the SNR threshold and the first detection fallback.
@@ -38,41 +51,91 @@ def get_filtered_photometry(alert, snr_threshold, first_detection_fallback):
         The alert containing photometry data.
     snr_threshold : float
         The SNR threshold to consider an object as too old.
-    first_detection_fallback : float
-        The Julian Date fallback for the first detection
+    first_detection_fallback_jd : float
+        The Julian Date fallback for the first detection, computed once by the caller for all the alerts
     Returns
     -------
     list or None
         A list of photometry points that includes the last non-detection and all detections,
         or None if too old or if there are no non-detections.
     """
-    last_non_detection = []
-    filtered_photometry = []
-    for phot in reversed(alert.get("photometry", [])):  # From the most recent to the oldest
-        if phot["programid"] != 1:
-            log(f"{RED}{alert['objectId']} has non-public photometry point, skipping it.{ENDC}")
-            continue
-        if phot["origin"] == "ForcedPhot" or not phot["flux_err"] or (phot["flux"] and phot["flux"] < 0):
-            continue # Skip forced photometry, no flux_err and negative fluxes
+    return get_filtered_photometries([alert], snr_threshold, first_detection_fallback_jd)[0]
+
 
-        if phot["flux"]:  # If it's a detection
-            last_non_detection = []  # Reset last non-detection as we found a detection
-            filtered_photometry.append(phot)
-            if phot["flux"] / phot["flux_err"] >= snr_threshold and phot["jd"] < first_detection_fallback:
-                # If at least one detection with SNR >= snr_threshold is older than first_detection_fallback, consider the object as too old and skip it
-                return None
-        elif not last_non_detection:
-            last_non_detection = [phot]
+def get_filtered_photometries(alerts, snr_threshold, first_detection_fallback_jd):
+    """
+    Filter the photometry of a batch of alerts, see get_filtered_photometry.
+
+    The photometry points of all the alerts are flattened into a single set of arrays,
+    and the per-alert reductions (too old, first detection, last non-detection) are computed
+    for all the alerts at once with reduceat over the offsets of each alert.
 
-    if not filtered_photometry and not last_non_detection:
-        log(f"{RED}Alert {alert['objectId']} does not have any valid detection or non-detection.{ENDC}")
-        return None
-    if not last_non_detection:
-        log(f"{YELLOW}Alert {alert['objectId']} does not have any non-detection before the first detection, skipping it.{ENDC}")
-        return None
+    Parameters
+    ----------
+    alerts : list[dict]
+        The alerts containing photometry data.
+    snr_threshold : float
+        The SNR threshold to consider an object as too old.
+    first_detection_fallback_jd : float
+        The Julian Date fallback for the first detection, computed once by the caller for all the alerts
+    Returns
+    -------
+    list
+        For each alert, the filtered photometry or None (see get_filtered_photometry).
+    """
+    results = [None] * len(alerts)
+    photometries = [alert.get("photometry") or [] for alert in alerts]
+    for alert, photometry in zip(alerts, photometries):
+        if not photometry:
+            log(f"{RED}Alert {alert['objectId']} does not have any valid detection or non-detection.{ENDC}")
+    with_photometry = [i for i, photometry in enumerate(photometries) if photometry]
+    if not with_photometry:
+        return results
+
+    # Read all the columns in a single pass over the photometry points of all the alerts (None becomes NaN)
+    points = list(itertools.chain.from_iterable(photometries[i] for i in with_photometry))
+    lengths = np.fromiter((len(photometries[i]) for i in with_photometry), dtype=np.intp, count=len(with_photometry))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    programid, origin, flux, flux_err, jd = zip(*map(PHOTOMETRY_COLUMNS, points))
+    public = np.array(programid) == 1
+    forced = np.array(origin) == "ForcedPhot"
+    flux = np.array(flux, dtype=np.float64)
+    flux_err = np.array(flux_err, dtype=np.float64)
+    flux_err[flux_err == 0] = np.nan
+    jd = np.array(jd, dtype=np.float64)
+
+    # Skip non-public and forced photometry, no flux_err and negative fluxes
+    valid = public & ~forced & np.isfinite(flux_err) & ~(flux < 0)
+    detection = valid & (flux > 0)
+    snr = np.full(len(points), np.nan)
+    snr[detection] = flux[detection] / flux_err[detection]
+    # If at least one detection with SNR >= snr_threshold is older than first_detection_fallback_jd, consider the object as too old and skip it
+    too_old = np.logical_or.reduceat((snr >= snr_threshold) & (jd < first_detection_fallback_jd), offsets[:-1])
+    non_public_counts = np.add.reduceat(~public, offsets[:-1])
+
+    # Only the non-detections before the first detection (all of them if there is no detection)
+    index = np.arange(len(points))
+    first_detection = np.minimum.reduceat(np.where(detection, index, len(points)), offsets[:-1])
+    before_first_detection = index < np.repeat(first_detection, lengths)
+    last_non_detection = np.maximum.reduceat(np.where(valid & ~detection & before_first_detection, index, -1), offsets[:-1])
+
+    for k, i in enumerate(with_photometry):
+        alert = alerts[i]
+        if non_public_counts[k]:
+            log(f"{RED}{alert['objectId']} has {non_public_counts[k]} non-public photometry point(s), skipping them.{ENDC}")
+        if too_old[k]:
+            continue
+        if first_detection[k] == len(points) and last_non_detection[k] < 0:
+            log(f"{RED}Alert {alert['objectId']} does not have any valid detection or non-detection.{ENDC}")
+            continue
+        if last_non_detection[k] < 0:
+            log(f"{YELLOW}Alert {alert['objectId']} does not have any non-detection before the first detection, skipping it.{ENDC}")
+            continue
 
-    # Keep the last non-detection and all detections
-    return last_non_detection + list(reversed(filtered_photometry))
+        # Keep the last non-detection and all detections
+        start, end = offsets[k], offsets[k + 1]
+        results[i] = [points[last_non_detection[k]]] + [points[j] for j in start + np.flatnonzero(detection[start:end])]
+    return results
 
 
 def boom_gcn_pipeline():
@@ -81,9 +144,19 @@ def boom_gcn_pipeline():
     snr_threshold = 5.0
     published_matches = {}  # {objectId: {"skymaps": set((dateobs,created_at)), "first_detection_jd": float}}
     skymaps = {} # {dateobs: Skymap}
+    skymaps_expiry = [] # heap of (dateobs timestamp, dateobs) of the skymaps, the oldest one is always first
+    skymaps_union = None # union of all the skymaps MOCs, rebuilt when skymaps change
+    skymaps_index = SkymapIndex.from_skymaps(skymaps) # skymaps as arrays for the crossmatch, rebuilt when skymaps change
+    skymaps_published_keys = set() # (dateobs, created_at) of all the skymaps, as stored in published_matches
 
     check_for_gcn_events_timer = None
+    gcn_poll_interval = SLEEP_TIME
+    min_gcn_poll_interval = min(MIN_SLEEP_TIME, SLEEP_TIME)
+    max_gcn_poll_interval = max(MAX_SLEEP_TIME, SLEEP_TIME)
     heartbeat_timer = time.time()
+
+    # MOCs persisted on disk for GCN events that expired while the pipeline was stopped
+    evict_moc_cache(datetime.fromtimestamp(heartbeat_timer - GCN * 3600, UTC).isoformat()[:19])
     total_processed_alerts = 0
     new_processed_alerts = 0
     log_empty_poll = True
@@ -92,21 +165,24 @@ def boom_gcn_pipeline():
     log(f"Listening for alerts passing the following Boom filters: {BOOM_FILTERS}")
 
     while True:
-        if time.time() - heartbeat_timer >= HEARTBEAT_INTERVAL:
-            heartbeat_timer = time.time()
+        # All the fallbacks of this iteration are derived from a single timestamp
+        now = time.time()
+        first_detection_fallback_jd = timestamp_to_jd(now) - FIRST_DETECTION / 24
+
+        if now - heartbeat_timer >= HEARTBEAT_INTERVAL:
+            heartbeat_timer = now
             produce_gcn_heartbeat()
 
         try:
-            # only check that every SLEEP_TIME seconds to avoid hitting the API
-            if not check_for_gcn_events_timer or time.time() - check_for_gcn_events_timer >= SLEEP_TIME:
-                check_for_gcn_events_timer = time.time() # reset timer
-
-                # Check if SkyPortal is available
-                skyportal.ping()
+            # only check that every gcn_poll_interval seconds to avoid hitting the API
+            if not check_for_gcn_events_timer or now - check_for_gcn_events_timer >= gcn_poll_interval:
+                check_for_gcn_events_timer = now # reset timer
+                gcn_fallback_timestamp = now - GCN * 3600
+                gcn_fallback = datetime.fromtimestamp(gcn_fallback_timestamp, UTC)
 
                 # Check for new GCN events or new localizations for existing events with "< 1000 sq. deg." tag
                 new_gcn_events = []
-                for event in skyportal.get_gcn_events(fallback(GCN)):
+                for event in skyportal.get_gcn_events(gcn_fallback):
                     if not event.get("aliases") or not any("#" in alias for alias in event["aliases"]):
                         if event.get("aliases"):
                             log(f"Skipping GCN event {event['dateobs']} due to bad aliases: {event['aliases']}")
@@ -114,7 +190,7 @@ def boom_gcn_pipeline():
 
                     event["localization"] = next(
                         (loc for loc in event.get("localizations", [])
-                         if any(tag["text"] == "< 1000 sq. deg." for tag in loc.get("tags", []))),
+                         if any(tag["text"] == LOCALIZATION_TAG for tag in loc.get("tags", []))),
                         None
                     )
                     if event["localization"] is None:
@@ -125,27 +201,55 @@ def boom_gcn_pipeline():
                         # If the localization is newer than the one we have for that dateobs, we should recompute this event
                         new_gcn_events.append(event)
 
-                for gcn_event in new_gcn_events:
-                    skymaps[gcn_event["dateobs"]] = get_skymap(skyportal, cumulative_probability, gcn_event)
+                added_mocs = []
+                updated_skymaps = False
+                for dateobs, skymap in get_skymaps(skyportal, cumulative_probability, new_gcn_events).items():
+                    if dateobs in skymaps:
+                        updated_skymaps = True
+                    else:
+                        heapq.heappush(skymaps_expiry, (iso_to_timestamp(dateobs), dateobs))
+                        added_mocs.append(skymap.coarse_moc)
+                    skymaps[dateobs] = skymap
                 if new_gcn_events:
                     log(f"Fetched {len(new_gcn_events)} skymaps and created MOCs")
 
+                # Poll more often while new localizations are coming in, and back off when idle
+                if new_gcn_events:
+                    gcn_poll_interval = max(min_gcn_poll_interval, gcn_poll_interval // 2)
+                else:
+                    gcn_poll_interval = min(max_gcn_poll_interval, gcn_poll_interval * 2)
+
                 # Clean up old skymaps (GCN events older than fallback)
-                gcn_fallback_iso = fallback(GCN, date_format="iso")[:19]
-                for dateobs in list(skymaps.keys()):
-                    if dateobs < gcn_fallback_iso:
-                        log(f"Removed expired skymap {dateobs} from skymaps")
-                        del skymaps[dateobs]
+                expired_skymaps = []
+                while skymaps_expiry and skymaps_expiry[0][0] < gcn_fallback_timestamp:
+                    expired_skymaps.append(heapq.heappop(skymaps_expiry)[1])
+                for dateobs in expired_skymaps:
+                    log(f"Removed expired skymap {dateobs} from skymaps")
+                    del skymaps[dateobs]
+                if expired_skymaps:
+                    # cached MOCs share the dateobs of their skymap, so they can only expire along with one
+                    evict_moc_cache(gcn_fallback.isoformat()[:19])
+
+                # The union is extended with new skymaps, and rebuilt when one is updated or removed
+                if updated_skymaps or expired_skymaps or skymaps_union is None:
+                    skymaps_union = union_moc(skymaps)
+                elif added_mocs:
+                    skymaps_union = skymaps_union.union(*added_mocs)
+                if added_mocs or updated_skymaps or expired_skymaps:
+                    skymaps_index = SkymapIndex.from_skymaps(skymaps)
+                skymaps_published_keys = {(dateobs, skymap.created_at) for dateobs, skymap in skymaps.items()}
 
-                first_detection_fallback_jd = fallback(FIRST_DETECTION, date_format="jd")
                 for obj_id, info in list(published_matches.items()):
                     if info["first_detection_jd"] < first_detection_fallback_jd:
                         log(f"Removed expired object {obj_id} from published_matches")
                         del published_matches[obj_id]
 
             # Consume new alerts passing a set of filters from Boom Kafka and crossmatch them with available skymaps
-            msg = consumer.poll(timeout=30.0)
-            if msg is None:
+            # Alerts are pushed by Kafka as soon as they are available, but stop waiting when the next GCN check is due
+            next_gcn_check = check_for_gcn_events_timer + gcn_poll_interval - time.time()
+            consume_timeout = min(MAX_CONSUME_TIMEOUT, max(next_gcn_check, 1.0))
+            messages = consumer.consume(num_messages=ALERT_BATCH_SIZE, timeout=consume_timeout)
+            if not messages:
                 if new_processed_alerts:
                     total_processed_alerts += new_processed_alerts
                     log(f"{new_processed_alerts} new alerts processed ({total_processed_alerts} total)")
@@ -154,48 +258,67 @@ def boom_gcn_pipeline():
                     log(f"No new alerts from Boom Kafka, waiting...")
                     log_empty_poll = False
                 continue
-            if msg.error():
-                log(f"Consumer error: {msg.error()}")
-                continue
             log_empty_poll = True
 
-            if skymaps:
+            valid_messages = []
+            for msg in messages:
+                if msg.error():
+                    log(f"Consumer error: {msg.error()}")
+                    continue
+                valid_messages.append(msg)
+
+            if not skymaps:
+                continue
+
+            boom_alerts = []
+            for msg in valid_messages:
                 alert = read_avro(msg)
 
                 if not any(boom_filter.get("filter_name") in BOOM_FILTERS for boom_filter in alert.get("filters", [])):
                     continue
-                obj_id = alert["objectId"]
                 new_processed_alerts += 1
-
-                filtered_photometry = get_filtered_photometry(alert, snr_threshold, fallback(FIRST_DETECTION, date_format="jd"))
+                boom_alerts.append(alert)
+
+            # Positions read once for the batch, the alerts outside of all the skymaps are rejected at once
+            boom_batch = AlertBatch.from_alerts(boom_alerts)
+            in_skymaps = []
+            for i in np.flatnonzero(contains_alerts(skymaps_union, boom_batch, skymaps_index.dec_range)):
+                published = published_matches.get(boom_batch.alerts[i]["objectId"])
+                if published and skymaps_published_keys <= published["skymaps"]:
+                    continue # Already published with every current skymap, it can't produce a new notice
+                in_skymaps.append(i)
+            filtered_photometries = get_filtered_photometries(
+                [boom_batch.alerts[i] for i in in_skymaps], snr_threshold, first_detection_fallback_jd
+            )
+            candidates = []
+            for i, filtered_photometry in zip(in_skymaps, filtered_photometries):
+                alert = boom_batch.alerts[i]
                 if not filtered_photometry or len(filtered_photometry) < 2:
                     continue # The First detection is too old or the alert doesn't have any detections/non-detections
+                alert["filtered_photometry"] = filtered_photometry
+                candidates.append(i)
+            alerts = boom_batch.select(candidates)
 
-                matching_skymaps = {}
-                for dateobs, skymap in skymaps.items():
-                    if not filtered_photometry[0]["jd"] <= skymap.jd <= filtered_photometry[1]["jd"]:
-                        continue # Skymap is not between the last non-detection and the first detection
-
+            # Skymaps between the last non-detection and the first detection of each alert, and containing it
+            for alert, matching_skymaps in zip(alerts.alerts, crossmatch(alerts, skymaps_index)):
+                obj_id = alert["objectId"]
+                filtered_photometry = alert["filtered_photometry"]
+                for dateobs, skymap in list(matching_skymaps.items()):
                     if obj_id in published_matches and (dateobs, skymap.created_at) in published_matches[obj_id].get("skymaps", set()):
                         log(f"Skipping already processed skymap {dateobs} for object {obj_id}")
-                        continue # This skymap has already been processed for this object
-
-                    if skymap.contains(alert["ra"], alert["dec"]):
-                        # If the object is in the skymap, add it to the matching_skymaps dictionary
-                        matching_skymaps[dateobs] = skymap
+                        del matching_skymaps[dateobs] # This skymap has already been processed for this object
 
                 if matching_skymaps:
                     # Process the crossmatch results here (e.g., send to GCN, log, etc.)
                     skymaps_string = ", ".join(skymap.name for skymap in matching_skymaps.values())
                     log(f"{obj_id} matches the following skymaps: {skymaps_string}")
-                    alert["filtered_photometry"] = filtered_photometry
 
                     # Publish the GCN notice with the alert data and matching skymaps to the GCN Kafka topic
                     gcn_payload = prepare_gcn_payload(alert, matching_skymaps)
                     produce_to_gcn(gcn_payload)
 
                     if NOTIFY_SLACK:
-                        send_to_slack(alert, matching_skymaps, gcn_payload)
+                        send_to_slack_in_background(alert, matching_skymaps, gcn_payload)
 
                     # Add the object and matching skymaps to published_matches to avoid re-processing
                     dateobs_created_at_tuple = set((dateobs, skymap.created_at) for dateobs, skymap in matching_skymaps.items())
@@ -239,7 +362,8 @@ if __name__ == "__main__":
         "-s",
         type=int,
         default=SLEEP_TIME,
-        help="Time in seconds to wait between each check for new GCN events.",
+        help="Initial time in seconds to wait between each check for new GCN events, "
+             "halved when new localizations are found and doubled when idle.",
     )
     parser.add_argument(
         "--clean-slack",
@@ -2,6 +2,11 @@ import json
 
 from gcn_kafka import Consumer
 
+try:
+    import orjson  # faster JSON parsing of the notices
+except ImportError:
+    orjson = None
+
 from utils.gcn import CLIENT_ID, CLIENT_SECRET, DOMAIN, TOPIC, HEARTBEAT_TOPIC
 from utils.logger import log, RED, YELLOW, ENDC
 
@@ -58,8 +63,7 @@ def gcn_notices_consumer(topics=None, offset_reset='latest'):
             log(f'topic={message.topic()}, offset={message.offset()}')
 
             try:
-                value = message.value().decode("utf-8")
-                data = json.loads(value)
+                data = orjson.loads(message.value()) if orjson else json.loads(message.value().decode("utf-8"))
                 print(json.dumps(data, indent=2))
 
             except Exception as e:
@@ -1,4 +1,5 @@
 import json
+import functools
 import urllib.request
 
 from astropy.time import Time
@@ -6,14 +7,22 @@ from gcn_kafka import Producer
 from jsonschema import Draft202012Validator
 from referencing import Registry, Resource
 
+try:
+    import orjson  # faster JSON serialization of the notices
+except ImportError:
+    orjson = None
+
 from utils.gcn import CLIENT_ID, CLIENT_SECRET, DOMAIN, SCHEMA, TOPIC, HEARTBEAT_TOPIC
 from utils.logger import log, RED, ENDC
 
-gcn_producer = Producer(
-    client_id=CLIENT_ID,
-    client_secret=CLIENT_SECRET,
-    domain=DOMAIN
-)
+@functools.lru_cache(maxsize=None)
+def get_gcn_producer():
+    """Create the GCN Kafka producer on first use, rather than whenever this module is imported."""
+    return Producer(
+        client_id=CLIENT_ID,
+        client_secret=CLIENT_SECRET,
+        domain=DOMAIN
+    )
 
 
 def _retrieve_remote_schema(uri):
@@ -21,23 +30,28 @@ def _retrieve_remote_schema(uri):
         return Resource.from_contents(json.load(response))
 
 
-try:
-    with urllib.request.urlopen(SCHEMA) as response:
-        schema = json.load(response)
-    registry = Registry(retrieve=_retrieve_remote_schema)
-    validator = Draft202012Validator(schema, registry=registry)
+@functools.lru_cache(maxsize=None)
+def get_validator():
+    """Build the GCN notice payload validator from the remote schema on first use, or None if it fails."""
+    try:
+        with urllib.request.urlopen(SCHEMA) as response:
+            schema = json.load(response)
+        registry = Registry(retrieve=_retrieve_remote_schema)
+        return Draft202012Validator(schema, registry=registry)
 
-except Exception as e:
-    log(f"{RED}Failed to build GCN notice payload validator: {e}{ENDC}")
-    log(f"{RED}GCN notice payloads will not be validated against the schema before being sent to Kafka.{ENDC}")
-    validator = None
+    except Exception as e:
+        log(f"{RED}Failed to build GCN notice payload validator: {e}{ENDC}")
+        log(f"{RED}GCN notice payloads will not be validated against the schema before being sent to Kafka.{ENDC}")
+        return None
 
 
 def produce_to_gcn(data, topic=TOPIC, validate=True):
-    if validate and validator:
+    validator = get_validator() if validate else None
+    if validator:
         validator.validate(data)
     # JSON data converted to byte string format
-    data = json.dumps(data).encode()
+    data = orjson.dumps(data) if orjson else json.dumps(data).encode()
+    gcn_producer = get_gcn_producer()
     gcn_producer.produce(topic, data)
     gcn_producer.flush()
 
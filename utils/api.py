@@ -1,11 +1,30 @@
+import atexit
 import functools
 import io
+import itertools
+import math
 import time
 import requests
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # faster JSON parsing for large pages
+except ImportError:
+    orjson = None
+
 from utils.logger import log, RED, YELLOW, ENDC
 
 SLOW_RESPONSE_THRESHOLD = 5  # seconds
+NUM_PER_PAGE = 1000  # items per page for paginated endpoints
+MAX_WORKERS = 8  # concurrent requests for paginated endpoints
+# keep-alive connections kept open, enough for the two GCN event queries paginating concurrently
+POOL_MAXSIZE = 2 * MAX_WORKERS
+LOCALIZATION_TAG = "< 1000 sq. deg."  # only the localizations with this tag are crossmatched
 
 class APIError(Exception):
     pass
@@ -15,9 +34,11 @@ def handle_timeout(method):
     """
     Decorator to handle requests timeouts and log slow responses.
     If a request takes longer than 5 seconds, log a warning.
-    If a request times out, raise a TimeoutError with a custom message.
+    If a request times out or SkyPortal can't be reached, raise an APIError with a custom message.
     """
-    def get_request_type(method_name, args):
+    method_name = method.__name__
+
+    def get_request_type(args):
         """Return the method name or endpoint being called if method is 'api'"""
         if method_name == "api" and len(args) > 1:
             return args[1] # endpoint
@@ -26,18 +47,20 @@ def handle_timeout(method):
     @functools.wraps(method)
     def wrapper(self, *args, **kwargs):
         try:
-            start = time.time()
+            start = time.monotonic()
             result = method(self, *args, **kwargs)
 
-            latency = time.time() - start
+            latency = time.monotonic() - start
             if latency > SLOW_RESPONSE_THRESHOLD:
-                log(f"{YELLOW}Warning - SkyPortal API is responding slowly to {get_request_type(method.__name__, args)} requests: {latency:.2f} seconds{ENDC}")
+                log(f"{YELLOW}Warning - SkyPortal API is responding slowly to {get_request_type(args)} requests: {latency:.2f} seconds{ENDC}")
 
             return result
         except APIError as e:
-            raise APIError(f"{RED}Api error in {get_request_type(method.__name__, args)}{ENDC} - {e}")
+            raise APIError(f"{RED}Api error in {get_request_type(args)}{ENDC} - {e}")
         except requests.exceptions.Timeout:
-            raise APIError(f"{RED}Timeout error{ENDC} - SkyPortal API not responding to {YELLOW}{get_request_type(method.__name__, args)}{ENDC} request")
+            raise APIError(f"{RED}Timeout error{ENDC} - SkyPortal API not responding to {YELLOW}{get_request_type(args)}{ENDC} request")
+        except requests.exceptions.ConnectionError:
+            raise APIError(f"{RED}Connection error{ENDC} - SkyPortal API unreachable for {YELLOW}{get_request_type(args)}{ENDC} request")
     return wrapper
 
 
@@ -62,6 +85,8 @@ class SkyPortal:
         Base URL of the SkyPortal instance
     headers : dict
         Authorization headers to use
+    session : requests.Session
+        Persistent session reusing keep-alive connections across requests
     """
 
     def __init__(self, instance, token, port=443, validate=True):
@@ -72,6 +97,25 @@ class SkyPortal:
         
         self.headers = {'Authorization': f'token {token}'}
 
+        # reuse connections across requests instead of opening a new TCP+TLS connection for each call
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=1,  # a single host
+            pool_maxsize=POOL_MAXSIZE,
+            # back off only when the server asks for it (rate limited or temporarily unavailable)
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=[429, 502, 503, 504],
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        atexit.register(self.session.close)
+
         # ping it to make sure it's up, if validate is True
         if validate:
             if not self.ping():
@@ -90,7 +134,7 @@ class SkyPortal:
         bool
             True if the API is available, False otherwise
         """
-        response = requests.get(f"{self.base_url}/api/sysinfo", timeout=40)
+        response = self.session.get(f"{self.base_url}/api/sysinfo", timeout=40)
         return response.status_code == 200
 
     @handle_timeout
@@ -103,15 +147,11 @@ class SkyPortal:
         bool
             True if the token is valid, False otherwise
         """
-        response = requests.get(
-            f"{self.base_url}/api/config",
-            headers=self.headers,
-            timeout=40
-        )
+        response = self.session.get(f"{self.base_url}/api/config", timeout=40)
         return response.status_code == 200
 
     @handle_timeout
-    def api(self, method: str, endpoint: str, data=None, return_response=False):
+    def api(self, method: str, endpoint: str, data=None, return_response=False, stream=False, headers=None):
         """
         Make an API request to SkyPortal
 
@@ -125,6 +165,10 @@ class SkyPortal:
             JSON data to send with the request, as parameters or payload
         return_response : bool, optional
             If True, return the raw response instead of parsing JSON
+        stream : bool, optional
+            If True, don't download the response body until it is accessed
+        headers : dict, optional
+            Additional headers to send with this request
 
         Returns
         -------
@@ -134,15 +178,15 @@ class SkyPortal:
         """
         endpoint = f'{self.base_url}/{endpoint.strip("/")}'
         if method == 'GET':
-            response = requests.request(method, endpoint, params=data, headers=self.headers, timeout=40)
+            response = self.session.request(method, endpoint, params=data, headers=headers, timeout=40, stream=stream)
         else:
-            response = requests.request(method, endpoint, json=data, headers=self.headers, timeout=40)
+            response = self.session.request(method, endpoint, json=data, headers=headers, timeout=40, stream=stream)
 
         if return_response:
             return response
 
         try:
-            body = response.json()
+            body = orjson.loads(response.content) if orjson else response.json()
         except Exception:
             raise APIError("Server error." if "server error" in response.text.lower() else response.text)
 
@@ -151,6 +195,44 @@ class SkyPortal:
 
         return body.get('data')
 
+    def iter_pages(self, endpoint, payload, item_key):
+        """
+        Iterate over the pages of a paginated API endpoint.
+        The first page gives the total number of matches and the page size used by the server
+        (which may be smaller than NUM_PER_PAGE), the next pages are then fetched
+        concurrently, at most MAX_WORKERS pages ahead of the page being consumed.
+
+        Yields
+        ------
+        list
+            The items of each page, in page order
+        """
+        payload = {**payload, "pageNumber": 1, "numPerPage": NUM_PER_PAGE}
+        results = self.api("GET", endpoint, data=payload)
+        page_size = len(results[item_key])
+        n_pages = math.ceil(results["totalMatches"] / page_size) if page_size else 1
+        if n_pages <= 1:
+            yield results[item_key]
+            return
+
+        def fetch_page(page_number):
+            return self.api("GET", endpoint, data={**payload, "pageNumber": page_number})[item_key]
+
+        executor = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, n_pages - 1))
+        try:
+            next_page = min(n_pages, MAX_WORKERS + 1) + 1
+            pending = deque(executor.submit(fetch_page, page_number) for page_number in range(2, next_page))
+            yield results[item_key]
+            while pending:
+                page_items = pending.popleft().result()
+                if next_page <= n_pages:
+                    pending.append(executor.submit(fetch_page, next_page))
+                    next_page += 1
+                yield page_items
+        finally:
+            # don't wait for pages that won't be consumed if the caller stops early
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def fetch_all_pages(self, endpoint, payload, item_key):
         """
         Fetch all pages of a paginated API endpoint
@@ -160,28 +242,18 @@ class SkyPortal:
         list
             All items from all pages
         """
-        items = []
-        payload["pageNumber"] = 1
-        payload["numPerPage"] = 1000
-        while True:
-            results = self.api("GET", endpoint, data=payload)
-            items += results[item_key]
-            if results["totalMatches"] <= len(items):
-                break
-            payload["pageNumber"] += 1
-            time.sleep(0.3)
-        return items
+        return list(itertools.chain.from_iterable(self.iter_pages(endpoint, payload, item_key)))
 
     def get_gcn_events(self, dateobs):
         """
         Get GCN events from SkyPortal filtered by dateobs and
-        specific tags:
-        - GW (any size)
-        - BNS (any size)
-        - NSBH (any size)
-        - SVOM (any notice)
-        - Einstein Probe (any notice)
-        - Fermi (< 1000 sq. deg.)
+        specific tags, with a localization tagged "< 1000 sq. deg.":
+        - GW
+        - BNS
+        - NSBH
+        - SVOM
+        - Einstein Probe
+        - Fermi
 
         Parameters
         ----------
@@ -196,44 +268,81 @@ class SkyPortal:
         payload = {
             "startDate": dateobs,
             "excludeNoticeContent": True,
+            # events without a small enough localization are not crossmatched, don't download them
+            "localizationTagKeep": LOCALIZATION_TAG,
         }
 
-        # Get GCN events with GW, BNS, NSBH, SVOM or Einstein Probe and without BBH, MLy or Terrestrial tags.
-        gcn_events = self.fetch_all_pages(
-            "/api/gcn_event",
+        # Two queries rather than one with all the tags: gcnTagRemove would also drop the Fermi
+        # events tagged BBH, MLy or Terrestrial, which are kept
+        queries = [
+            # GCN events with GW, BNS, NSBH, SVOM or Einstein Probe and without BBH, MLy or Terrestrial tags.
             {
                 **payload,
                 "gcnTagKeep":"GW,BNS,NSBH,SVOM,Einstein Probe",
                 "gcnTagRemove": "BBH,MLy,Terrestrial"
             },
-            "events"
-        )
-
-        # Get GCN events with Fermi tag and localization < 1000 sq.deg.
-        gcn_events += self.fetch_all_pages(
-            "/api/gcn_event",
-            {**payload,"gcnTagKeep": "Fermi","localizationTagKeep": "< 1000 sq. deg."},
-            "events"
-        )
-        return gcn_events
-
-    def download_localization(self, dateobs, localization_name):
+            # GCN events with Fermi tag
+            {**payload,"gcnTagKeep": "Fermi"},
+        ]
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            results = executor.map(lambda query: self.fetch_all_pages("/api/gcn_event", query, "events"), queries)
+            # an event can match both queries (e.g. with both GW and Fermi tags), keep it once
+            return list({event["dateobs"]: event for events in results for event in events}.values())
+
+    def download_localization(self, dateobs, localization_name, etag=None, last_modified=None, return_headers=False):
         """
         Download localization as a FITS file from SkyPortal.
 
+        Parameters
+        ----------
+        dateobs : str
+            Date of observation of the GCN event
+        localization_name : str
+            Name of the localization to download
+        etag : str, optional
+            ETag of a previously downloaded version, sent as If-None-Match
+        last_modified : str, optional
+            Last-Modified of a previously downloaded version, sent as If-Modified-Since
+        return_headers : bool, optional
+            If True, also return the response headers (e.g. to keep the ETag for later downloads)
+
         Returns
         -------
-        io.BytesIO
-            A BytesIO object containing the FITS file data.
+        io.BytesIO or None
+            A BytesIO object containing the FITS file data,
+            or None if the localization has not been modified since the given etag/last_modified.
+        requests.structures.CaseInsensitiveDict
+            The response headers, only if `return_headers` is True.
         """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
         response = self.api(
             "GET",
             f"/api/localization/{dateobs}/name/{localization_name}/download",
-            return_response=True
+            return_response=True,
+            stream=True,
+            headers=headers
         )
-        if response.status_code != 200:
-            raise ValueError(f"Error fetching localization: {response.text}")
-        return io.BytesIO(response.content) # return a BytesIO object containing the FITS file
+        with response:
+            if response.status_code == 304:
+                bytes_io = None
+            elif response.status_code != 200:
+                raise ValueError(f"Error fetching localization: {response.text}")
+            else:
+                # write the body chunk by chunk instead of buffering it in full first
+                bytes_io = io.BytesIO()
+                try:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        bytes_io.write(chunk)
+                except requests.exceptions.RequestException as e:
+                    # the body is read after api() returned, outside of handle_timeout
+                    raise APIError(f"{RED}Download error{ENDC} - localization {YELLOW}{dateobs} {localization_name}{ENDC} truncated: {e}")
+                bytes_io.seek(0)
+        return (bytes_io, response.headers) if return_headers else bytes_io
 
     def get_objects(self, payload):
         """
@@ -1,12 +1,14 @@
 import math
+import time
 
-from astropy.time import Time
-from datetime import datetime, timedelta, UTC
+from datetime import datetime, UTC
 
 # BOOM stores ZTF flux as mag2flux(mag, 23.9) * 1e9 (see boom/src/alert/ztf.rs),
 # so we need to adjust the zero point accordingly.
 BOOM_ZTF_FLUX_ZP = 23.9 + 2.5 * math.log10(1e9)
 _FACTOR = 2.5 / math.log(10)
+UNIX_EPOCH_JD = 2440587.5 # Julian Date of 1970-01-01T00:00:00 UTC
+MJD_OFFSET = 2400000.5 # difference between the Julian Date and the Modified Julian Date
 
 def flux_to_mag(flux, zp=BOOM_ZTF_FLUX_ZP):
     """Convert flux to AB magnitude."""
@@ -24,6 +26,29 @@ def flux_err_to_limiting_mag(flux_err, zp=BOOM_ZTF_FLUX_ZP):
     return -2.5 * math.log10(5.0 * flux_err) + zp
 
 
+def timestamp_to_jd(timestamp):
+    """Convert a Unix timestamp, e.g. from time.time(), to a UTC Julian Date."""
+    return timestamp / 86400 + UNIX_EPOCH_JD
+
+
+def datetime_to_jd(date):
+    """Convert a timezone-aware datetime to a UTC Julian Date without building an astropy Time."""
+    return timestamp_to_jd(date.timestamp())
+
+
+def iso_to_timestamp(date):
+    """Convert an ISO 8601 date string to a Unix timestamp, considering dates without a timezone as UTC."""
+    date = datetime.fromisoformat(date)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=UTC)
+    return date.timestamp()
+
+
+def iso_to_jd(date):
+    """Convert an ISO 8601 date string to a UTC Julian Date without building an astropy Time (see iso_to_timestamp)."""
+    return timestamp_to_jd(iso_to_timestamp(date))
+
+
 def fallback(hours=0, seconds=0, date_format=None):
     """Get a fallback date by subtracting a specified amount of time from the current UTC time.
 
@@ -44,13 +69,14 @@ def fallback(hours=0, seconds=0, date_format=None):
     datetime or str or float
         The fallback date in the specified format.
     """
-    date = datetime.now(UTC) - timedelta(hours=hours, seconds=seconds)
-    if date_format == "iso":
-        return date.isoformat()
+    timestamp = time.time() - hours * 3600 - seconds
     if date_format == "mjd":
-        return Time(date).mjd
+        return timestamp_to_jd(timestamp) - MJD_OFFSET
     if date_format == "jd":
-        return Time(date).jd
+        return timestamp_to_jd(timestamp)
+    date = datetime.fromtimestamp(timestamp, UTC)
+    if date_format == "iso":
+        return date.isoformat()
     return date
 
 
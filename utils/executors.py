@@ -0,0 +1,30 @@
+import atexit
+import multiprocessing
+import os
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+CROSSMATCH_WORKERS = min(8, os.cpu_count() or 1) # threads testing the skymaps of large batches, numpy releases the GIL
+PLOT_WORKERS = min(4, os.cpu_count() or 1) # processes rendering the skymap plots, matplotlib holds the GIL
+
+crossmatch_executor = ThreadPoolExecutor(max_workers=CROSSMATCH_WORKERS)
+atexit.register(crossmatch_executor.shutdown, wait=False)
+
+_plot_executor = None
+
+
+def get_plot_executor():
+    """Return the process pool rendering the skymap plots, spawned on first use as forking would copy the Kafka threads."""
+    global _plot_executor
+    if _plot_executor is None:
+        _plot_executor = ProcessPoolExecutor(max_workers=PLOT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(_plot_executor.shutdown, wait=False, cancel_futures=True)
+    return _plot_executor
+
+
+def reset_plot_executor():
+    """Shut down the plot process pool after a worker died, the next get_plot_executor call starts a new one."""
+    global _plot_executor
+    if _plot_executor is not None:
+        _plot_executor.shutdown(wait=False, cancel_futures=True)
+        _plot_executor = None
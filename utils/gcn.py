@@ -1,4 +1,5 @@
 import os
+import operator
 
 from dotenv import load_dotenv
 from astropy.time import Time
@@ -22,8 +23,14 @@ DOMAIN = os.getenv("GCN_KAFKA_SERVER" if not TESTING_MODE else "GCN_KAFKA_TEST_S
 TOPIC = os.getenv("GCN_KAFKA_TOPIC" if not TESTING_MODE else "GCN_KAFKA_TEST_TOPIC")
 HEARTBEAT_TOPIC = f"{TOPIC}.heartbeat"
 
+PHOTOMETRY_POINT_COLUMNS = operator.itemgetter("band", "flux", "flux_err")
+
 
 def prepare_gcn_payload(obj, matching_skymaps):
+    photometry = obj["filtered_photometry"]
+    # Convert all the observation times at once, a Time per photometry point is much slower
+    observation_starts = Time([p["jd"] for p in photometry], format="jd", precision=3).isot
+    event_name = obj["objectId"]
     payload = {
         '$schema': SCHEMA,
         "alert_datetime": Time.now().isot + "Z",
@@ -45,21 +52,22 @@ def prepare_gcn_payload(obj, matching_skymaps):
                     } for skymap in matching_skymaps.values()],
                 }
             ],
+            # the columns of each point are read at once, rather than with a dict lookup per field
             "photometry": [{
-                "event_name": obj["objectId"],
-                "observation_start": Time(p["jd"], format="jd", precision=3).isot + "Z",
+                "event_name": event_name,
+                "observation_start": observation_start + "Z",
                 "telescope": "Palomar 1.2m Oschin",
                 "instrument": "ZTF",
-                "filter": p["band"],
+                "filter": band,
                 **(
                     {
-                        "mag": round(flux_to_mag(p["flux"]), 2),
-                        "mag_error": round(flux_err_to_mag_error(p["flux"], p["flux_err"]), 2),
-                    } if p["flux"] and p["flux_err"] else {}
+                        "mag": round(flux_to_mag(flux), 2),
+                        "mag_error": round(flux_err_to_mag_error(flux, flux_err), 2),
+                    } if flux and flux_err else {}
                 ),
                 "mag_system": "AB",
-                "limiting_mag": round(flux_err_to_limiting_mag(p["flux_err"]), 2),
-            } for p in obj["filtered_photometry"]]
+                "limiting_mag": round(flux_err_to_limiting_mag(flux_err), 2),
+            } for (band, flux, flux_err), observation_start in zip(map(PHOTOMETRY_POINT_COLUMNS, photometry), observation_starts)]
         },
     }
     return payload
\ No newline at end of file
@@ -1,4 +1,4 @@
-from datetime import datetime, UTC
+import time
 
 GREEN = "\033[32m"
 YELLOW = "\033[33m"
@@ -6,4 +6,4 @@ RED = "\033[31m"
 ENDC = "\033[0m"
 
 def log(message):
-    print(f"{datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')} - {message}")
\ No newline at end of file
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} - {message}")
\ No newline at end of file
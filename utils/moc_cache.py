@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+from dotenv import load_dotenv
+from mocpy import MOC
+
+from utils.logger import log, YELLOW, ENDC
+
+load_dotenv()
+
+MOC_CACHE_DIR = os.getenv("MOC_CACHE_DIR") # directory where the MOCs are kept across restarts, disabled if not set
+
+# {(dateobs, localization_name, cumulative_probability): (created_at, MOC, etag, last_modified)}
+_moc_cache = {}
+
+
+def get_cached_moc(key):
+    """Return the cache entry of a localization, from memory or else from MOC_CACHE_DIR, or None."""
+    return _moc_cache.get(key) or _load_moc_from_disk(key)
+
+
+def cache_moc(key, created_at, moc, etag, last_modified, save_moc=True):
+    """Cache the MOC of a localization with the validators of its FITS file, in memory and in MOC_CACHE_DIR.
+
+    With save_moc=False, e.g. when the localization was not modified, only the metadata is written to disk.
+    """
+    _moc_cache[key] = (created_at, moc, etag, last_modified)
+    _save_moc_to_disk(key, created_at, moc, etag, last_modified, save_moc)
+
+
+def evict_moc_cache(dateobs_fallback):
+    """Remove the cached MOCs of localizations older than dateobs_fallback (ISO format), in memory and on disk."""
+    for key in [key for key in _moc_cache if key[0] < dateobs_fallback]:
+        del _moc_cache[key]
+    if not MOC_CACHE_DIR or not os.path.isdir(MOC_CACHE_DIR):
+        return
+    for filename in os.listdir(MOC_CACHE_DIR):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(MOC_CACHE_DIR, filename[:-len(".json")])
+        try:
+            with open(f"{path}.json") as f:
+                dateobs = json.load(f)["key"][0]
+        except Exception:
+            continue
+        if dateobs < dateobs_fallback:
+            for extension in (".json", ".fits"):
+                try:
+                    os.remove(f"{path}{extension}")
+                except FileNotFoundError:
+                    pass
+
+
+def _moc_cache_path(key):
+    """Return the path, without extension, of the files of a cached MOC in MOC_CACHE_DIR."""
+    return os.path.join(MOC_CACHE_DIR, hashlib.sha1(repr(key).encode()).hexdigest())
+
+
+def _load_moc_from_disk(key):
+    """Load a MOC from MOC_CACHE_DIR into the memory cache, and return its cache entry (or None)."""
+    if not MOC_CACHE_DIR:
+        return None
+    path = _moc_cache_path(key)
+    try:
+        with open(f"{path}.json") as f:
+            metadata = json.load(f)
+        moc = MOC.load(f"{path}.fits", format="fits")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log(f"{YELLOW}Failed to load the cached MOC of {key[0]} {key[1]} from disk: {e}{ENDC}")
+        return None
+    _moc_cache[key] = (metadata["created_at"], moc, metadata["etag"], metadata["last_modified"])
+    return _moc_cache[key]
+
+
+def _save_moc_to_disk(key, created_at, moc, etag, last_modified, save_moc=True):
+    """Write a MOC and its metadata to MOC_CACHE_DIR, the metadata last so only complete entries are loaded."""
+    if not MOC_CACHE_DIR:
+        return
+    path = _moc_cache_path(key)
+    metadata = {"key": list(key), "created_at": created_at, "etag": etag, "last_modified": last_modified}
+    try:
+        os.makedirs(MOC_CACHE_DIR, exist_ok=True)
+        if save_moc or not os.path.exists(f"{path}.fits"):
+            moc.save(f"{path}.fits.tmp", format="fits", overwrite=True)
+            os.replace(f"{path}.fits.tmp", f"{path}.fits")
+        with open(f"{path}.json.tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+    except Exception as e:
+        log(f"{YELLOW}Failed to save the MOC of {key[0]} {key[1]} to disk: {e}{ENDC}")
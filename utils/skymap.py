@@ -1,18 +1,35 @@
+import bisect
 import io
+import threading
 import numpy as np
 import astropy.units as u
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from PIL import Image
 
 from mocpy import MOC
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
-from astropy.time import Time
-from astropy_healpix import HEALPix
+from functools import cached_property
+from astropy_healpix import HEALPix, uniq_to_level_ipix, level_to_nside
 from astropy.wcs import WCS
 from astropy.io import fits
 from astropy.visualization.wcsaxes.frame import EllipticalFrame
 
-from utils.logger import log
+from utils.logger import log, YELLOW, ENDC
+from utils.converter import iso_to_jd
+from utils.executors import crossmatch_executor, get_plot_executor, reset_plot_executor, PLOT_WORKERS
+from utils.moc_cache import get_cached_moc, cache_moc
+
+MOC_MAX_DEPTH = 29 # deepest HEALPix order of a MOC, its ranges are expressed at this depth
+_max_depth_healpix = HEALPix(nside=1 << MOC_MAX_DEPTH, order="nested")
+DEC_RANGE_MARGIN = 1e-6 # degrees added around the declination range of a MOC, to absorb rounding errors
+UNION_MOC_ORDER = 8 # order of the union MOC prefilter, ~0.23 deg cells, coarser than the skymaps but close to their borders
+CREDIBLE_REGION_MARGIN = 1e-6 # cumulative probability kept past the threshold of a MOC before building it
+PARALLEL_CROSSMATCH_MIN_PAIRS = 100_000 # below this many (skymap, alert) pairs to test, threads cost more than they save
 
 
 @dataclass
@@ -33,6 +50,12 @@ class Skymap:
         A list of tags associated with the event, such as "GW", "GRB", "SVOM" or "Einstein Probe"
     jd : float
         The Julian Date corresponding to dateobs.
+    ranges : np.ndarray
+        The sorted (n_ranges, 2) HEALPix ranges of the MOC at depth 29, used to test many pixels at once.
+    dec_range : tuple[float, float]
+        The minimum and maximum declination covered by the MOC, in degrees, to reject alerts before testing the MOC.
+    max_order : int
+        The deepest HEALPix order of the MOC cells.
     """
     dateobs: str
     alias: str
@@ -40,10 +63,16 @@ class Skymap:
     created_at: str
     tags: list[str]
     jd: float = field(init=False)
+    ranges: np.ndarray = field(init=False, repr=False)
+    dec_range: tuple[float, float] = field(init=False)
+    max_order: int = field(init=False)
 
     def __post_init__(self):
-        """Calculate the Julian Date from dateobs after initialization."""
-        self.jd = Time(self.dateobs).jd
+        """Calculate the Julian Date from dateobs, the MOC ranges, declination range and order after initialization."""
+        self.jd = iso_to_jd(self.dateobs)
+        self.ranges = self.moc.to_depth29_ranges
+        self.dec_range = moc_dec_range(self.moc)
+        self.max_order = int(self.moc.max_order)
 
     @property
     def name(self):
@@ -74,8 +103,218 @@ class Skymap:
         return self.alias.split("#")[1] if "#" in self.alias else None
 
     def contains(self, ra, dec):
-        """Check if the given (ra, dec) coordinates are contained within the MOC."""
-        return self.moc.contains_lonlat(ra * u.deg, dec * u.deg)
+        """Check if the given (ra, dec) coordinates, in degrees, are contained within the MOC.
+        Accepts scalars or arrays, in which case a boolean array is returned."""
+        return self.moc.contains_lonlat(ra << u.deg, dec << u.deg)
+
+    @cached_property
+    def coarse_moc(self):
+        """The MOC degraded to UNION_MOC_ORDER, which contains it, used to build the union prefilter (see union_moc)."""
+        return self.moc.degrade_to_order(UNION_MOC_ORDER) if self.max_order > UNION_MOC_ORDER else self.moc
+
+    @cached_property
+    def range_bounds(self):
+        """The starts and ends of the MOC ranges as lists, built on first use to bisect single pixels."""
+        return self.ranges[:, 0].tolist(), self.ranges[:, 1].tolist()
+
+    def contains_ipix(self, ipix):
+        """Check which HEALPix pixels at depth 29 (see lonlat_to_ipix) are contained within the MOC."""
+        if ipix.size == 1:
+            # A single pixel is bisected in the Python lists, avoiding the numpy call overhead
+            starts, ends = self.range_bounds
+            pixel = int(ipix[0])
+            idx = bisect.bisect_right(starts, pixel) - 1
+            return np.array([idx >= 0 and pixel < ends[idx]])
+        idx = np.searchsorted(self.ranges[:, 0], ipix, side="right") - 1
+        return (idx >= 0) & (ipix < self.ranges[np.maximum(idx, 0), 1])
+
+
+@dataclass
+class AlertBatch:
+    """A batch of alerts with their positions stored as arrays, to test them all at once against the MOCs.
+
+    Attributes
+    ----------
+    alerts : list[dict]
+        The alerts of the batch, used to build the GCN notices of the matches.
+    ra : np.ndarray
+        The right ascension of each alert, in degrees.
+    dec : np.ndarray
+        The declination of each alert, in degrees.
+    """
+    alerts: list[dict]
+    ra: np.ndarray
+    dec: np.ndarray
+
+    @classmethod
+    def from_alerts(cls, alerts):
+        """Read the positions of the alerts once, in a single pass."""
+        ra, dec = np.array([(alert["ra"], alert["dec"]) for alert in alerts], dtype=np.float64).reshape(-1, 2).T
+        return cls(alerts, ra, dec)
+
+    def select(self, indices):
+        """Return a new batch with only the alerts at the given indices."""
+        indices = np.asarray(indices, dtype=np.intp)
+        return AlertBatch([self.alerts[i] for i in indices], self.ra[indices], self.dec[indices])
+
+    def __len__(self):
+        return len(self.alerts)
+
+
+@dataclass
+class SkymapIndex:
+    """The skymaps laid out as parallel lists and arrays, built once when the skymaps change
+    rather than for every crossmatched batch.
+
+    Attributes
+    ----------
+    dateobs : list[str]
+        The dateobs of each skymap.
+    skymaps : list[Skymap]
+        The skymaps, in the same order as dateobs.
+    jds : np.ndarray
+        The Julian Date of each skymap.
+    dec_ranges : np.ndarray
+        The (n_skymaps, 2) declination range of each skymap, in degrees.
+    """
+    dateobs: list[str]
+    skymaps: list[Skymap]
+    jds: np.ndarray
+    dec_ranges: np.ndarray
+
+    @classmethod
+    def from_skymaps(cls, skymaps):
+        """Build the index of a dictionary of skymaps keyed by dateobs."""
+        skymap_list = list(skymaps.values())
+        jds = np.fromiter((skymap.jd for skymap in skymap_list), dtype=np.float64, count=len(skymap_list))
+        dec_ranges = np.array([skymap.dec_range for skymap in skymap_list], dtype=np.float64).reshape(-1, 2)
+        return cls(list(skymaps), skymap_list, jds, dec_ranges)
+
+    @property
+    def dec_range(self):
+        """The declination range covered by all the skymaps, in degrees."""
+        if not len(self.skymaps):
+            return np.inf, -np.inf # no skymaps, contains nothing
+        return float(self.dec_ranges[:, 0].min()), float(self.dec_ranges[:, 1].max())
+
+    def __len__(self):
+        return len(self.skymaps)
+
+
+def moc_dec_range(moc):
+    """Return the minimum and maximum declination covered by a MOC, in degrees.
+
+    The extreme latitudes of a HEALPix cell are reached at its north and south vertices,
+    so the range is computed from the vertices of the MOC cells, grouped by order.
+    """
+    orders, ipix = uniq_to_level_ipix(moc.uniq_hpx.astype(np.int64))
+    if not ipix.size:
+        return np.inf, -np.inf # empty MOC, contains nothing
+    dec_min, dec_max = 90.0, -90.0
+    for order in np.unique(orders):
+        healpix = HEALPix(nside=level_to_nside(int(order)), order="nested")
+        _, lat = healpix.boundaries_lonlat(ipix[orders == order], step=1)
+        lat = lat.to_value(u.deg)
+        dec_min, dec_max = min(dec_min, lat.min()), max(dec_max, lat.max())
+    return float(dec_min) - DEC_RANGE_MARGIN, float(dec_max) + DEC_RANGE_MARGIN
+
+
+def lonlat_to_ipix(ra, dec):
+    """Convert (ra, dec) arrays, in degrees, to the nested HEALPix pixels at depth 29 used by the MOC ranges."""
+    # uint64 like the MOC ranges, as comparing them with int64 would go through float64
+    return _max_depth_healpix.lonlat_to_healpix(ra << u.deg, dec << u.deg).astype(np.uint64)
+
+
+def crossmatch(alerts, skymaps):
+    """Crossmatch a batch of alerts with the skymaps.
+
+    An alert matches a skymap if the skymap dateobs is between the alert last non-detection
+    and first detection, and if the alert position is contained in the skymap MOC.
+
+    Parameters
+    ----------
+    alerts : AlertBatch
+        Alerts with "filtered_photometry" (last non-detection followed by the detections).
+    skymaps : SkymapIndex or dict
+        The index of the skymaps, or a dictionary of skymaps keyed by dateobs to index.
+
+    Returns
+    -------
+    list[dict]
+        For each alert, the matching skymaps keyed by dateobs.
+    """
+    if not isinstance(skymaps, SkymapIndex):
+        skymaps = SkymapIndex.from_skymaps(skymaps)
+    matches = [{} for _ in range(len(alerts))]
+    if not len(alerts):
+        return matches
+
+    n_alerts = len(alerts)
+    last_non_detection_jds = np.fromiter((alert["filtered_photometry"][0]["jd"] for alert in alerts.alerts), dtype=np.float64, count=n_alerts)
+    first_detection_jds = np.fromiter((alert["filtered_photometry"][1]["jd"] for alert in alerts.alerts), dtype=np.float64, count=n_alerts)
+
+    dateobs_list, skymap_list, skymap_jds = skymaps.dateobs, skymaps.skymaps, skymaps.jds
+
+    # (n_skymaps, n_alerts) matrix of matches, starting with the time windows and declination ranges of all the pairs at once
+    matched = (last_non_detection_jds <= skymap_jds[:, None]) & (skymap_jds[:, None] <= first_detection_jds)
+    matched &= (skymaps.dec_ranges[:, :1] <= alerts.dec) & (alerts.dec <= skymaps.dec_ranges[:, 1:])
+
+    # Only the alerts left in at least one skymap are converted to pixels
+    to_test = matched.any(axis=0)
+    ipix = np.zeros(n_alerts, dtype=np.uint64)
+    ipix[to_test] = lonlat_to_ipix(alerts.ra[to_test], alerts.dec[to_test])
+
+    windows = [(i, np.flatnonzero(matched[i])) for i in range(len(skymap_list))]
+    windows = [(i, in_window) for i, in_window in windows if in_window.size]
+    if len(windows) > 1 and sum(in_window.size for _, in_window in windows) >= PARALLEL_CROSSMATCH_MIN_PAIRS:
+        # costliest searches first, so that no thread is left idle at the end
+        windows.sort(key=lambda window: window[1].size * np.log2(len(skymap_list[window[0]].ranges) + 2), reverse=True)
+        results = crossmatch_executor.map(lambda window: skymap_list[window[0]].contains_ipix(ipix[window[1]]), windows)
+    else:
+        results = (skymap_list[i].contains_ipix(ipix[in_window]) for i, in_window in windows)
+    for (i, in_window), contained in zip(windows, results):
+        matched[i, in_window] = contained
+
+    for i, j in zip(*np.nonzero(matched)):
+        matches[j][dateobs_list[i]] = skymap_list[i]
+    return matches
+
+
+def contains_alerts(moc, alerts, dec_range=None):
+    """Check which alerts are contained in the MOC, with a single call for all of them.
+
+    Parameters
+    ----------
+    moc : MOC or None
+        The MOC to test, e.g. the union of the skymaps (see union_moc). None contains nothing.
+    alerts : AlertBatch
+        The alerts to test.
+    dec_range : tuple[float, float], optional
+        The declination range covered by the MOC, in degrees (see SkymapIndex.dec_range).
+        The alerts outside of it are rejected with two comparisons, without querying the MOC.
+
+    Returns
+    -------
+    np.ndarray
+        A boolean array, True for the alerts contained in the MOC.
+    """
+    contained = np.zeros(len(alerts), dtype=bool)
+    if moc is None or not len(alerts):
+        return contained
+    if dec_range is None:
+        return moc.contains_lonlat(alerts.ra << u.deg, alerts.dec << u.deg)
+    in_range = (dec_range[0] <= alerts.dec) & (alerts.dec <= dec_range[1])
+    if in_range.any():
+        contained[in_range] = moc.contains_lonlat(alerts.ra[in_range] << u.deg, alerts.dec[in_range] << u.deg)
+    return contained
+
+
+def union_moc(skymaps):
+    """Return the union of the coarse MOCs of the skymaps, used as a prefilter, or None if there are no skymaps."""
+    mocs = [skymap.coarse_moc for skymap in skymaps.values()]
+    if not mocs:
+        return None
+    return mocs[0].union(*mocs[1:]) if len(mocs) > 1 else mocs[0]
 
 
 def get_skymap(skyportal, cumulative_probability, event):
@@ -84,16 +323,73 @@ def get_skymap(skyportal, cumulative_probability, event):
     Downloads the event's localization from SkyPortal, extracts the MOC at the
     given cumulative_probability threshold, and wraps it with identifying metadata.
     """
-    localization = event["localization"]
-    bytes_io = skyportal.download_localization(
-        localization["dateobs"], localization["localization_name"]
-    )
-    moc = get_moc_from_fits(bytes_io, cumulative_probability)
+    return get_skymaps(skyportal, cumulative_probability, [event])[event["dateobs"]]
+
+
+def get_skymaps(skyportal, cumulative_probability, events, max_workers=8):
+    """Build the Skymaps for a list of SkyPortal GCN events.
+
+    The localizations are downloaded concurrently, only if not cached or modified (see utils.moc_cache).
+
+    Parameters
+    ----------
+    skyportal : SkyPortal
+        The SkyPortal client used to download the localizations.
+    cumulative_probability : float
+        The cumulative probability threshold for the MOCs.
+    events : list[dict]
+        The GCN events, each with the selected "localization".
+    max_workers : int, optional
+        The maximum number of concurrent downloads and MOC builds. Default is 8.
+
+    Returns
+    -------
+    dict
+        A dictionary of Skymap objects keyed by the event dateobs.
+    """
+    skymaps = {}
+    to_download = {}  # {cache_key: [events]}
+    for event in events:
+        localization = event["localization"]
+        key = (localization["dateobs"], localization["localization_name"], cumulative_probability)
+        cached = get_cached_moc(key)
+        if cached and cached[0] == localization["created_at"]:
+            skymaps[event["dateobs"]] = build_skymap(event, cached[1])
+        else:
+            to_download.setdefault(key, []).append(event)
+
+    if not to_download:
+        return skymaps
+
+    def download_and_build(key):
+        _, moc, etag, last_modified = get_cached_moc(key) or (None, None, None, None)
+        bytes_io, headers = skyportal.download_localization(
+            key[0], key[1], etag=etag, last_modified=last_modified, return_headers=True
+        )
+        if bytes_io is not None:  # otherwise not modified since it was cached
+            moc = get_moc_from_fits(bytes_io, cumulative_probability)
+            etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        cache_moc(
+            key, to_download[key][0]["localization"]["created_at"], moc, etag, last_modified, save_moc=bytes_io is not None
+        )
+        return [build_skymap(event, moc) for event in to_download[key]]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(to_download))) as executor:
+        futures = {executor.submit(download_and_build, key): key for key in to_download}
+        for future in as_completed(futures):
+            key = futures[future]
+            for event, skymap in zip(to_download[key], future.result()):
+                skymaps[event["dateobs"]] = skymap
+    return skymaps
+
+
+def build_skymap(event, moc):
+    """Build a Skymap from a GCN event and the MOC of its selected localization."""
     return Skymap(
         dateobs=event["dateobs"],
         alias=next((a for a in event["aliases"] if "#" in a), "No aliases"), # Use the first alias that contains "#"
         moc=moc,
-        created_at=localization["created_at"],
+        created_at=event["localization"]["created_at"],
         tags=event.get("tags", [])
     )
 
@@ -108,45 +404,130 @@ def get_moc_from_fits(bytes_io, cumulative_probability):
     cumulative_probability : float
         The cumulative probability threshold for the MOC.
     """
-    with fits.open(bytes_io) as hdul:
+    # The file is already in memory, the columns are read at once as native-endian arrays
+    with fits.open(bytes_io, memmap=False, lazy_load_hdus=False) as hdul:
         data = hdul[1].data
         columns = [col.name for col in hdul[1].columns]
         header = hdul[1].header
+        if "UNIQ" in columns:
+            uniq = np.asarray(data["UNIQ"], dtype=np.int64)
+            probdensity = np.asarray(data["PROBDENSITY"], dtype=np.float64)
+        else:
+            prob_col = next(c for c in columns if c in ("PROB", "PROBABILITY", "PROBDENSITY"))
+            prob = np.ravel(np.asarray(data[prob_col], dtype=np.float64))
 
     if "UNIQ" in columns:
-        uniq = data["UNIQ"]
-        probdensity = data["PROBDENSITY"]
-        orders = (np.log2(uniq // 4)) // 2
-        area = np.pi / (3 * 4**orders) * u.sr
-        prob = probdensity * area
+        # integer orders from the position of the highest bit of uniq, no float log2
+        orders, _ = uniq_to_level_ipix(uniq)
+        area = np.ldexp(np.pi / 3, -2 * orders) # in steradians, 4pi / (12 * 4**order)
+        prob = probdensity * area # plain array, without Quantity arithmetic
+        credible = credible_region_mask(prob, cumulative_probability, densities=probdensity)
+        uniq, prob = uniq[credible], prob[credible]
     else:
-        prob_col = next(c for c in columns if c in ("PROB", "PROBABILITY", "PROBDENSITY"))
-        prob = np.ravel(data[prob_col])
         npix = len(prob)
         nside = int(np.sqrt(npix / 12))
         order = int(np.log2(nside))
 
+        # Only the pixels of the credible region are kept, before converting their indices
+        indices = np.flatnonzero(credible_region_mask(prob, cumulative_probability))
+        prob = prob[indices]
+
         # UNIQ scheme uses NESTED ordering
         ordering = header.get("ORDERING", "NESTED").upper()
         if ordering == "RING":
-            ring_hp = HEALPix(nside=nside, order="ring")
-            nested_hp = HEALPix(nside=nside, order="nested")
-            lon, lat = ring_hp.healpix_to_lonlat(np.arange(npix))
-            nested_indices = nested_hp.lonlat_to_healpix(lon, lat)
-            reordered = np.empty(npix)
-            reordered[nested_indices] = prob
-            prob = reordered
-
-        indices = np.arange(npix)
+            # sorted back in nested order, as mocpy breaks the ties between equal probabilities by position
+            indices = HEALPix(nside=nside, order="ring").ring_to_nested(indices)
+            nested_order = np.argsort(indices)
+            indices, prob = indices[nested_order], prob[nested_order]
+
         uniq = 4 * (4 ** order) + indices
 
     return MOC.from_valued_healpix_cells(uniq, prob, 29, cumul_to=cumulative_probability)
 
 
+def credible_region_mask(prob, cumulative_probability, densities=None):
+    """Select the densest cells, a little past the cumulative probability, that MOC.from_valued_healpix_cells can keep.
+
+    Parameters
+    ----------
+    prob : np.ndarray
+        The probability of each cell.
+    cumulative_probability : float
+        The cumulative probability threshold for the MOC.
+    densities : np.ndarray, optional
+        The probability density of each cell. If not given, the cells all have the same area,
+        so they are ordered by their probabilities.
+
+    Returns
+    -------
+    np.ndarray
+        A boolean mask of the cells to keep.
+    """
+    if densities is None:
+        # same area for all the cells, the probabilities are the densities
+        densities = prob
+        sorted_densities = sorted_prob = np.sort(prob)[::-1]
+    else:
+        order = np.argsort(densities)[::-1]
+        sorted_densities, sorted_prob = densities[order], prob[order]
+    cumulative = np.cumsum(sorted_prob)
+    last = np.searchsorted(cumulative, cumulative_probability + CREDIBLE_REGION_MARGIN)
+    if last >= len(sorted_prob) or not np.isfinite(cumulative[-1]):
+        return np.ones(len(prob), dtype=bool) # NaN probabilities are left to mocpy
+    return densities >= sorted_densities[last]
+
+
+# All-sky projection of the skymap plots, and the figure reused by every plot (see _get_plot_axes)
+_plot_projection = WCS({
+    "naxis": 2,
+    "naxis1": 1620,
+    "naxis2": 810,
+    "crpix1": 810.5,
+    "crpix2": 405.5,
+    "cdelt1": -0.2,
+    "cdelt2": 0.2,
+    "ctype1": "RA---AIT",
+    "ctype2": "DEC--AIT",
+    "crval1": 0.0,
+    "crval2": 0.0,
+})
+_plot_axes = None
+_plot_crop = None # (rows, columns) slices of the canvas kept in the images, like bbox_inches="tight"
+_plot_lock = threading.Lock()
+
+
+def _get_plot_axes():
+    """Return the axes of the reused skymap figure and its crop, created on first use."""
+    global _plot_axes, _plot_crop
+    if _plot_axes is None:
+        # Rendered with Agg directly, outside of pyplot, so no interactive backend is ever initialized
+        fig = Figure(figsize=(10, 5))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1, projection=_plot_projection, frame_class=EllipticalFrame)
+        ax.grid()
+        ax.coords[0].set_ticklabel_visible(False)
+        # The limits set by mocpy when plotting a MOC
+        x_max, y_max = 2 * _plot_projection.wcs.crpix - 1
+        ax.set_xlim(0, x_max)
+        ax.set_ylim(0, y_max)
+
+        # The frame never changes, so the tight bounding box of savefig is computed once
+        fig.canvas.draw()
+        bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)
+        x0, y0, x1, y1 = np.array(bbox.extents) * fig.dpi
+        width, height = int(x1 - x0), int(y1 - y0) # truncated like the size of a tight savefig
+        top = fig.canvas.get_width_height()[1] - int(y1)
+        _plot_crop = (slice(max(top, 0), top + height), slice(max(int(x0), 0), int(x0) + width))
+        _plot_axes = ax
+    return _plot_axes, _plot_crop
+
+
 def plot_object_on_skymap(obj, moc):
     """
     Returns a PNG image of the skymap with the object overlaid.
 
+    The figure is reused, only the MOC and the object are drawn again.
+
     Parameters
     ----------
     obj : dict
@@ -159,36 +540,63 @@ def plot_object_on_skymap(obj, moc):
     bytes : BytesIO
         A BytesIO object containing the PNG image data.
     """
-    projection = WCS({
-        "naxis": 2,
-        "naxis1": 1620,
-        "naxis2": 810,
-        "crpix1": 810.5,
-        "crpix2": 405.5,
-        "cdelt1": -0.2,
-        "cdelt2": 0.2,
-        "ctype1": "RA---AIT",
-        "ctype2": "DEC--AIT",
-        "crval1": 0.0,
-        "crval2": 0.0,
-    })
-
-    fig = plt.figure(figsize=(10, 5))
-    ax = fig.add_subplot(1, 1, 1, projection=projection, frame_class=EllipticalFrame)
-    moc.fill(ax=ax, wcs=projection, alpha=0.4, color="red")
-    moc.border(ax=ax, wcs=projection, color="red")
-    ax.grid()
-    ax.coords[0].set_ticklabel_visible(False)
-    ax.scatter(obj["ra"], obj["dec"], transform=ax.get_transform("world"),marker='*',
-               s=120, c="blue", edgecolor="black", label=obj["objectId"], zorder=2)
-
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format="png", bbox_inches="tight")
-    plt.close(fig)
+    with _plot_lock:
+        ax, crop = _get_plot_axes()
+        try:
+            moc.fill(ax=ax, wcs=_plot_projection, alpha=0.4, color="red")
+            moc.border(ax=ax, wcs=_plot_projection, color="red")
+            ax.scatter(obj["ra"], obj["dec"], transform=ax.get_transform("world"),marker='*',
+                       s=120, c="blue", edgecolor="black", label=obj["objectId"], zorder=2)
+
+            ax.figure.canvas.draw()
+            image = Image.fromarray(np.asarray(ax.figure.canvas.buffer_rgba())[crop])
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", compress_level=1)
+        finally:
+            for artist in [*ax.patches, *ax.collections, *ax.lines]:
+                artist.remove()
     buffer.seek(0)
     return buffer
 
 
+def _plot_object_on_skymap_bytes(obj, moc):
+    """Render a plot in a worker process, returning the PNG bytes."""
+    return plot_object_on_skymap(obj, moc).getvalue()
+
+
+def plot_object_on_skymaps(obj, mocs):
+    """
+    Returns the PNG images of several skymaps with the object overlaid, see plot_object_on_skymap.
+
+    The plots are rendered in parallel in worker processes (see utils.executors).
+
+    Parameters
+    ----------
+    obj : dict
+        Object with {"objectId", "ra", "dec"} in degrees.
+    mocs : list[MOC]
+        The MOC objects representing the skymaps.
+
+    Returns
+    -------
+    list[BytesIO]
+        A BytesIO object containing the PNG image data, for each MOC.
+    """
+    if len(mocs) <= 1 or PLOT_WORKERS <= 1:
+        return [plot_object_on_skymap(obj, moc) for moc in mocs]
+
+    plot_obj = {key: obj[key] for key in ("objectId", "ra", "dec")}  # the full alert is not needed to plot it
+    try:
+        return [io.BytesIO(png) for png in get_plot_executor().map(_plot_object_on_skymap_bytes, [plot_obj] * len(mocs), mocs)]
+    except BrokenProcessPool as e:
+        log(f"{YELLOW}Skymap plot worker died ({e}), plotting in the main process{ENDC}")
+        reset_plot_executor()
+        return [plot_object_on_skymap(obj, moc) for moc in mocs]
+    except RuntimeError:
+        # the pool refuses new work while the interpreter is exiting
+        return [plot_object_on_skymap(obj, moc) for moc in mocs]
+
+
 def display_skymaps(obj, skymaps, plot=False):
     """Display information about the skymaps that match the given object and optionally plot them.
 
@@ -201,10 +609,17 @@ def display_skymaps(obj, skymaps, plot=False):
     plot : bool, optional
         Whether to plot the skymaps using matplotlib. Default is False.
     """
+    if plot:
+        # Only imported to display the plots interactively, the pipeline never needs pyplot
+        import matplotlib.pyplot as plt
+        import matplotlib.image as mpimg
+
     ra, dec = obj["ra"], obj["dec"]
+    # The position is converted once, then tested against the ranges of each MOC
+    ipix = lonlat_to_ipix(np.array([ra], dtype=np.float64), np.array([dec], dtype=np.float64))
     log(f"Displaying {len(skymaps)} skymap(s) for {obj['objectId']} (ra={ra:.5f}, dec={dec:.5f}):")
     for dateobs, skymap in skymaps.items():
-        is_in = skymap.contains(ra, dec)
+        is_in = skymap.contains_ipix(ipix)[0]
         is_match = f"{'  ' if is_in else 'NO'} MATCH"
         log(f"Type: {skymap.type} | Instrument: {skymap.instrument} | Id: {skymap.id} | [{is_match}] {skymap.alias} dateobs={dateobs}")
 
@@ -1,13 +1,19 @@
 import io
 import json
+import functools
 import os
 import time
+import atexit
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 from slack_sdk import WebClient
-from datetime import datetime, UTC
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
 
-from utils.skymap import plot_object_on_skymap
+from utils.skymap import plot_object_on_skymaps
+from utils.logger import log, RED, ENDC
 
 load_dotenv()
 
@@ -18,9 +24,14 @@ slack_channel_name = os.getenv("SLACK_CHANNEL_NAME")
 client = None
 slack_channel_id = None
 
+# A single worker sends the messages in order and off the main loop, without adding to the Slack rate limits
+_slack_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slack")
+atexit.register(_slack_executor.shutdown, wait=True) # pending messages are sent before exiting, plotted in-process if needed
+
 
+@functools.lru_cache(maxsize=32)
 def get_channel_id(channel_name):
-    """Get the Slack channel ID for the specified channel name."""
+    """Get the Slack channel ID for the specified channel name, the channels are only listed once per name."""
     cursor = None
     while True:
         response = client.conversations_list(
@@ -50,29 +61,56 @@ def init_slack():
     if not slack_bot_token or not slack_channel_name:
         raise RuntimeError("SLACK_BOT_TOKEN and SLACK_CHANNEL_NAME must be set.")
     client = WebClient(token=slack_bot_token)
+    client.retry_handlers.append(RateLimitErrorRetryHandler(max_retry_count=2)) # wait for Retry-After when rate limited
     slack_channel_id = get_channel_id(slack_channel_name)
     if not slack_channel_id:
         raise RuntimeError(f"Slack channel '{slack_channel_name}' not found.")
 
 
 def send_to_slack(obj, matching_skymaps, gcn_payload):
-    """Send a message to Slack with the object details and crossmatch plots."""
+    """Send a message to Slack with the object details and crossmatch plots.
+
+    The GCN notice payload and the plots of all the matching skymaps are uploaded together,
+    as a single message, to make a single files upload transaction against the Slack rate limits.
+    """
+    aliases = "_".join([skymap.alias for skymap in matching_skymaps.values()])
+    file_uploads = [{
+        "filename": f"gcn_notice_payload_{obj['objectId']}_{aliases}.json",
+        "title": f"gcn_notice_payload_{obj['objectId']}_{aliases}.json",
+        "file": io.BytesIO(json.dumps(gcn_payload, indent=2, ensure_ascii=False).encode("utf-8")),
+    }]
+    plots = plot_object_on_skymaps(obj, [skymap.moc for skymap in matching_skymaps.values()])
+    for skymap, plot in zip(matching_skymaps.values(), plots):
+        file_uploads.append({
+            "filename": f"{obj['objectId']}_{skymap.alias}.png",
+            "file": plot,
+        })
+
+    skymap_links = "\n".join(
+        f"*Alias:* <{skyportal_url}/gcn_events/{dateobs}|{skymap.alias}>" for dateobs, skymap in matching_skymaps.items()
+    )
     client.files_upload_v2(
         channel=slack_channel_id,
         initial_comment=(
             f"*New object in Skymaps localization*\n"
-            f"*Date:* {datetime.now(UTC).replace(microsecond=0).isoformat()} UTC\n"
+            f"*Date:* {time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())} UTC\n"
             f"*Object:* <{skyportal_url}/source/{obj['objectId']}|{obj['objectId']}>\n"
-            f"*GCN notice payload:*"
+            f"{skymap_links}\n"
+            f"*GCN notice payload and skymaps plots:*"
         ),
-        title= f"gcn_notice_payload_{obj['objectId']}_{'_'.join([skymap.alias for skymap in matching_skymaps.values()])}.json",
-        file= io.BytesIO(json.dumps(gcn_payload, indent=2, ensure_ascii=False).encode("utf-8")),
+        file_uploads=file_uploads,
+        request_file_info=False, # the uploaded files details are not used
     )
 
-    for dateobs, skymap in matching_skymaps.items():
-        client.files_upload_v2(
-            channel=slack_channel_id,
-            filename=f"{obj['objectId']}_{skymap.alias}.png",
-            initial_comment=f"*Alias:* <{skyportal_url}/gcn_events/{dateobs}|{skymap.alias}>",
-            file=plot_object_on_skymap(obj, skymap.moc),
-        )
+
+def _log_slack_error(future):
+    """Log the error of a message sent in the background, as nothing waits for its result."""
+    error = future.exception()
+    if error is not None:
+        log(f"{RED}Failed to send a message to Slack:{ENDC}")
+        traceback.print_exception(error)
+
+
+def send_to_slack_in_background(obj, matching_skymaps, gcn_payload):
+    """Queue a message for send_to_slack, so that the plots and uploads don't delay the alerts processing."""
+    _slack_executor.submit(send_to_slack, obj, dict(matching_skymaps), gcn_payload).add_done_callback(_log_slack_error)